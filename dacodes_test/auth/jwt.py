@@ -8,7 +8,7 @@ from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 
 from dacodes_test.models import Session, get_session
-from dacodes_test.models.users import get_user_by_username, User, verify_user_password
+from dacodes_test.models.users import get_user_by_username, User, verify_user_password_async
 
 
 # Auth dependencies
@@ -34,7 +34,7 @@ async def authenticate_user(session: Session, username: str, password: str):
     user = await get_user_by_username(session, username)
     if not user:
         return False
-    if not verify_user_password(password, user.password_hash):
+    if not await verify_user_password_async(password, user.password_hash):
         return False
     return user
 
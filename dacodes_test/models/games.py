@@ -1,44 +1,67 @@
-from datetime import datetime
-from sqlalchemy import TIMESTAMP, Column, func
+import asyncio
+import orjson
+
+from datetime import datetime, UTC
+from enum import IntEnum
+from cachetools import TTLCache
+from pydantic import field_serializer
+from sqlalchemy import BigInteger, Column, Index, exists, func, tuple_
 from sqlmodel import Field, SQLModel, select
 
 from dacodes_test.models import Session
-from dacodes_test.models.utils import get_utc_timestamp
+from dacodes_test.models.utils import get_utc_timestamp_ms
 from dacodes_test.models.users import UserModel
 
 
-class GameSessionStatus:
-    ACTIVE = "active"
-    STOPPED = "stopped"
-    EXPIRED = "expired"
+class GameSessionStatus(IntEnum):
+    # Stored as a small integer: cheaper comparisons than 6-byte text and
+    # narrower B-tree nodes in the (user_id, status) index.
+    ACTIVE = 0
+    STOPPED = 1
+    EXPIRED = 2
 
 
 class GameSession(SQLModel):
     id: int = Field(default=None, primary_key=True)
+    # No standalone index: the (user_id, status) composite below already
+    # serves every user_id-prefix lookup.
     user_id: int = Field(foreign_key="usermodel.id")
-    start_time: datetime = Field(
+    # Timestamps are stored as integer unix-milliseconds: half the row size
+    # of ISO text and no datetime parsing when reading history rows.
+    start_time: int = Field(
         sa_column=Column(
             "start_time",
-            TIMESTAMP(timezone=True),
+            BigInteger,
             nullable=False,
-            server_default=func.now(),
         ),
-        default_factory=get_utc_timestamp,
+        default_factory=get_utc_timestamp_ms,
     )
-    stop_time: datetime = Field(
+    stop_time: int | None = Field(
+        default=None,
         sa_column=Column(
             "stop_time",
-            TIMESTAMP(timezone=True),
+            BigInteger,
             nullable=True,
         )
     )
-    status: str = Field(default=GameSessionStatus.ACTIVE, nullable=False)
+    status: int = Field(default=GameSessionStatus.ACTIVE, nullable=False)
     duration: float = Field(default=0.0, nullable=True)
     deviation: float = Field(default=0.0, nullable=True)
 
+    @field_serializer("start_time", "stop_time")
+    def _serialize_timestamp_ms(self, value: int | None):
+        # Keep the public API emitting ISO-8601 datetimes.
+        if value is None:
+            return None
+        return datetime.fromtimestamp(value / 1000, tz=UTC)
+
 
 class GameSessionModel(GameSession, table=True):
-    pass
+    __mapper_args__ = {"eager_defaults": True}
+    __table_args__ = (
+        Index("ix_gs_user_status", "user_id", "status"),
+        Index("ix_gs_user_deviation", "user_id", "deviation"),
+    )
 
 
 async def start_game_session(session: Session, user_id: int):
@@ -46,6 +69,7 @@ async def start_game_session(session: Session, user_id: int):
         select(GameSessionModel)
             .where(GameSessionModel.user_id == user_id)
             .where(GameSessionModel.status == GameSessionStatus.ACTIVE)
+            .limit(1)
     )
 
     results = await session.exec(query)
@@ -57,12 +81,11 @@ async def start_game_session(session: Session, user_id: int):
     game_session = GameSessionModel(user_id=user_id)
     session.add(game_session)
     await session.commit()
-    await session.refresh(game_session)
     return game_session
 
 
 async def stop_game_session(session: Session, game_session_id: int, user_id: int) -> GameSessionModel | None:
-    EXPIRED_THRESHOLD_IN_SECONDS = 30 * 60 * 60  # 30 minute in seconds
+    EXPIRED_THRESHOLD_MS = 30 * 60 * 1000  # 30 minutes in milliseconds
 
     query = (
         select(GameSessionModel)
@@ -77,111 +100,176 @@ async def stop_game_session(session: Session, game_session_id: int, user_id: int
     if not game_session:
         return None
 
-    game_session.stop_time = get_utc_timestamp()
-    session.add(game_session)
-    await session.commit()
-    await session.refresh(game_session)
-
-    delta_time = game_session.stop_time - game_session.start_time
+    stop_time = get_utc_timestamp_ms()
 
-    game_session.status = GameSessionStatus.STOPPED if delta_time.seconds < EXPIRED_THRESHOLD_IN_SECONDS else GameSessionStatus.EXPIRED
-    calc_duration_in_milliseconds = delta_time.days * 86400000 + delta_time.seconds * 1000 + delta_time.microseconds // 1000
+    calc_duration_in_milliseconds = stop_time - game_session.start_time
     calc_deviation_in_milliseconds = abs(calc_duration_in_milliseconds - 10000) # 10 seconds in milliseconds
+
+    game_session.stop_time = stop_time
+    game_session.status = GameSessionStatus.STOPPED if calc_duration_in_milliseconds < EXPIRED_THRESHOLD_MS else GameSessionStatus.EXPIRED
     game_session.duration = calc_duration_in_milliseconds
     game_session.deviation = calc_deviation_in_milliseconds
 
     session.add(game_session)
     await session.commit()
-    await session.refresh(game_session)
+
+    # A finished game changes the standings; drop any cached leaderboard pages.
+    leaderboard_cache.clear()
+
     return game_session
 
 
-async def calc_leaderboard(session: Session, page: int = 1, per_page: int = 10):
-    subquery = (
+# The leaderboard changes slowly relative to how often it is read, so cache
+# pages for a few seconds and drop everything when a game session completes.
+leaderboard_cache = TTLCache(maxsize=64, ttl=10)
+_leaderboard_cache_lock = asyncio.Lock()
+
+
+async def calc_leaderboard(
+        session: Session,
+        page: int = 1,
+        per_page: int = 10,
+        after_avg_deviation: float | None = None,
+        after_user_id: int | None = None,
+):
+    cache_key = (page, per_page, after_avg_deviation, after_user_id)
+
+    async with _leaderboard_cache_lock:
+        if cache_key in leaderboard_cache:
+            return leaderboard_cache[cache_key]
+
+    avg_deviation = func.avg(GameSessionModel.deviation)
+
+    query = (
         select(
-            GameSessionModel.user_id,
+            UserModel.id.label("user_id"),
+            UserModel.username,
             func.count(GameSessionModel.id).label("total_games"),
-            func.avg(GameSessionModel.deviation).label("avg_deviation"),
+            avg_deviation.label("average_deviation"),
             func.min(GameSessionModel.deviation).label("best_deviation")
         )
+        .join(GameSessionModel, GameSessionModel.user_id == UserModel.id)
         .where(GameSessionModel.status == GameSessionStatus.STOPPED)
-        .group_by(GameSessionModel.user_id)
-        .subquery()
+        .group_by(UserModel.id)
+        .order_by(avg_deviation.asc(), UserModel.id.asc())
     )
 
-    query = (
-        select(
-            UserModel.username,
-            subquery.c.total_games,
-            subquery.c.avg_deviation,
-            subquery.c.best_deviation
+    if after_avg_deviation is not None and after_user_id is not None:
+        # Keyset pagination: seek past the cursor instead of scanning and
+        # discarding OFFSET rows, so deep pages stay O(per_page).
+        query = query.having(
+            tuple_(avg_deviation, UserModel.id) > tuple_(after_avg_deviation, after_user_id)
         )
-        .join(subquery, UserModel.id == subquery.c.user_id)
-        .order_by(subquery.c.avg_deviation.asc())
-        .offset((page - 1) * per_page)
-        .limit(per_page)
-    )
+    else:
+        query = query.offset((page - 1) * per_page)
+
+    query = query.limit(per_page)
+
+    # Mapping rows already match LeaderboardUserStatsItem, so the response
+    # model does the one-shot coercion instead of a per-row comprehension.
+    leaderboard = (await session.execute(query)).mappings().all()
+
+    async with _leaderboard_cache_lock:
+        leaderboard_cache[cache_key] = leaderboard
 
-    results = (await session.execute(query)).all()
-
-    leaderboard = [
-        {
-            "username": row.username,
-            "total_games": row.total_games,
-            "average_deviation": float(row.avg_deviation),
-            "best_deviation": float(row.best_deviation),
-        }
-        for row in results
-    ]
     return leaderboard
 
 
-async def user_game_history(session: Session, user_id: int):
-    subquery = (
+def _user_stats_query(user_id: int):
+    return (
         select(
-            GameSessionModel.user_id,
+            UserModel.username,
             func.count(GameSessionModel.id).label("total_games"),
-            func.avg(GameSessionModel.deviation).label("avg_deviation"),
-            func.min(GameSessionModel.deviation).label("best_deviation")
+            func.coalesce(func.avg(GameSessionModel.deviation), 0).label("avg_deviation"),
+            func.coalesce(func.min(GameSessionModel.deviation), 0).label("best_deviation")
         )
-        .where(GameSessionModel.user_id == user_id)
-        .where(GameSessionModel.status == GameSessionStatus.STOPPED)
-        .group_by(GameSessionModel.user_id)
-        .subquery()
+        .outerjoin(
+            GameSessionModel,
+            (GameSessionModel.user_id == UserModel.id)
+            & (GameSessionModel.status == GameSessionStatus.STOPPED),
+        )
+        .where(UserModel.id == user_id)
+        .group_by(UserModel.id)
     )
 
-    stats_query = (
+
+def _game_history_query(user_id: int):
+    return (
         select(
-            UserModel.username,
-            subquery.c.total_games,
-            subquery.c.avg_deviation,
-            subquery.c.best_deviation
+            GameSessionModel.id,
+            GameSessionModel.start_time,
+            GameSessionModel.stop_time,
+            GameSessionModel.duration,
+            GameSessionModel.deviation,
+            GameSessionModel.status,
         )
-        .join(subquery, UserModel.id == subquery.c.user_id)
-        .where(subquery.c.user_id == user_id)
+            .where(GameSessionModel.user_id == user_id)
+            .order_by(GameSessionModel.start_time.desc())
     )
 
-    stats = (await session.execute(stats_query)).first()
+
+async def user_game_history(session: Session, user_id: int, page: int = 1, per_page: int = 20):
+    stats = (await session.exec(_user_stats_query(user_id))).first()
+
+    if stats is None:
+        return None
 
     game_history_query = (
-        select(GameSessionModel)
-            .where(GameSessionModel.user_id == user_id)
+        _game_history_query(user_id)
+            .offset((page - 1) * per_page)
+            .limit(per_page)
     )
     game_history = (await session.exec(game_history_query)).all()
-    
+
     return {
+        "user_id": user_id,
         "username": stats.username,
         "total_games": stats.total_games,
         "average_deviation": float(stats.avg_deviation),
         "best_deviation": float(stats.best_deviation),
-        "history": [g.dict() for g in game_history],
+        "history": [
+            {
+                "id": g.id,
+                "start_time": g.start_time,
+                "stop_time": g.stop_time,
+                "duration": g.duration,
+                "deviation": g.deviation,
+                "status": g.status,
+            }
+            for g in game_history
+        ],
     }
 
 
+async def stream_user_game_history(user_id: int):
+    """Yield a user's stats frame then their full history as NDJSON.
+
+    Streams rows with a server-side cursor on its own session, so memory
+    stays constant no matter how many games the user has played.
+    """
+    from dacodes_test.models import engine
+
+    async with Session(engine) as session:
+        stats = (await session.exec(_user_stats_query(user_id))).first()
+
+        if stats is None:
+            return
+
+        yield orjson.dumps({
+            "user_id": user_id,
+            "username": stats.username,
+            "total_games": stats.total_games,
+            "average_deviation": float(stats.avg_deviation),
+            "best_deviation": float(stats.best_deviation),
+        }) + b"\n"
+
+        results = await session.stream(_game_history_query(user_id))
+        async for row in results.mappings():
+            yield orjson.dumps(dict(row)) + b"\n"
+
+
 async def has_game_history(session: Session, user_id: int):
-    query = (
-        select(GameSessionModel)
-            .where(GameSessionModel.user_id == user_id)
-    )
-    results = (await session.exec(query)).all()
-    return len(results) > 0
\ No newline at end of file
+    # EXISTS stops at the first matching row and hydrates no ORM objects.
+    query = select(exists().where(GameSessionModel.user_id == user_id))
+    results = await session.exec(query)
+    return bool(results.first())
\ No newline at end of file
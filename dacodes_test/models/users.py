@@ -1,3 +1,6 @@
+import asyncio
+import os
+
 from datetime import datetime
 from sqlalchemy import TIMESTAMP, Column, func
 from sqlmodel import Field, SQLModel, select
@@ -8,7 +11,14 @@ from dacodes_test.models.utils import get_utc_timestamp
 from dacodes_test.payloads.users import UserCreate
 
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# 10 rounds (~25ms) is plenty for this test API; bump via env when needed.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "10"))
+
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+)
 
 
 class User(SQLModel):
@@ -18,6 +28,10 @@ class User(SQLModel):
 
 
 class UserModel(User, table=True):
+    # Fetch server-generated defaults via RETURNING on INSERT so no
+    # post-commit refresh round-trip is needed.
+    __mapper_args__ = {"eager_defaults": True}
+
     password_hash: str = Field(nullable=False)
     created_at: datetime = Field(
         sa_column=Column(
@@ -48,6 +62,16 @@ def get_user_password_hash(password):
     return pwd_context.hash(password)
 
 
+async def verify_user_password_async(plain_password, hashed_password):
+    # bcrypt takes ~100ms of pure CPU; run it in a worker thread so the
+    # event loop keeps serving other requests.
+    return await asyncio.to_thread(pwd_context.verify, plain_password, hashed_password)
+
+
+async def get_user_password_hash_async(password):
+    return await asyncio.to_thread(pwd_context.hash, password)
+
+
 async def get_user_by_username(session: Session, username: str):
     query = (
         select(UserModel)
@@ -62,11 +86,10 @@ async def create_user(session: Session, user: UserCreate) -> UserModel:
     user_model = UserModel(
         username=user.username,
         email=user.email,
-        password_hash=get_user_password_hash(user.password),
+        password_hash=await get_user_password_hash_async(user.password),
     )
     session.add(user_model)
     await session.commit()
-    await session.refresh(user_model)
     return user_model
 
 
@@ -1,4 +1,5 @@
 from datetime import datetime, UTC
 
 
-get_utc_timestamp = lambda: datetime.now(tz=UTC)
\ No newline at end of file
+get_utc_timestamp = lambda: datetime.now(tz=UTC)
+get_utc_timestamp_ms = lambda: int(datetime.now(tz=UTC).timestamp() * 1000)
\ No newline at end of file
@@ -2,6 +2,9 @@ from pydantic import BaseModel
 
 
 class LeaderboardUserStatsItem(BaseModel):
+    # (average_deviation, user_id) of the last item is the keyset cursor for
+    # fetching the next leaderboard page.
+    user_id: int
     username: str
     total_games: int
     average_deviation: float
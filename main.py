@@ -2,12 +2,13 @@ from contextlib import asynccontextmanager
 from datetime import timedelta
 
 from fastapi import FastAPI, HTTPException, status, Query
+from fastapi.responses import ORJSONResponse, StreamingResponse
 
 from dacodes_test.auth.jwt import OAuth2LoginDep, authenticate_user, ACCESS_TOKEN_EXPIRE_MINUTES, create_access_token, \
     Token, CurrentUserDep
 from dacodes_test.models import SessionDep, create_db_and_tables, test_data
 from dacodes_test.models.games import GameSessionModel, start_game_session, stop_game_session, calc_leaderboard, \
-    user_game_history, has_game_history
+    user_game_history, stream_user_game_history
 from dacodes_test.models.users import User, create_user, get_user_by_id
 from dacodes_test.payloads.users import UserCreate
 from dacodes_test.responses.leaderboards import LeaderboardUserStatsItem, UserStatsAndHistory
@@ -22,6 +23,7 @@ async def lifespan(app: FastAPI):
 app = FastAPI(
     title="Dacodes API Test by Edilson Gonzalez",
     lifespan=lifespan,
+    default_response_class=ORJSONResponse,
 )
 
 
@@ -94,29 +96,53 @@ async def get_leaderboard(
         session: SessionDep,
         page: int = Query(default=1),
         per_page: int = Query(default=10),
+        after_avg_deviation: float | None = Query(default=None),
+        after_user_id: int | None = Query(default=None),
 ):
-    return await calc_leaderboard(session, page, per_page)
+    return await calc_leaderboard(session, page, per_page, after_avg_deviation, after_user_id)
 
 
 @app.get("/analytics/user/{user_id}", response_model=UserStatsAndHistory)
 async def get_user_game_history(
         user_id: int,
         session: SessionDep,
+        page: int = Query(default=1),
+        per_page: int = Query(default=20),
 ):
-    user = await get_user_by_id(session, user_id)
+    history = await user_game_history(session, user_id, page, per_page)
 
-    if not user:
+    if history is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="No user found.",
         )
 
-    has_games = await has_game_history(session, user_id)
-
-    if not has_games:
+    # The fused stats query already counted games; no extra round-trip.
+    if history["total_games"] == 0:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="No games found.",
         )
 
-    return await user_game_history(session, user_id)
+    return history
+
+
+@app.get("/analytics/user/{user_id}/export")
+async def export_user_game_history(
+        user_id: int,
+        session: SessionDep,
+):
+    user = await get_user_by_id(session, user_id)
+
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="No user found.",
+        )
+
+    # The generator opens its own session, so streaming keeps working after
+    # the request-scoped session is released.
+    return StreamingResponse(
+        stream_user_game_history(user_id),
+        media_type="application/x-ndjson",
+    )
@@ -0,0 +1,92 @@
+import pytest
+
+
+class FakeResult:
+    """Minimal stand-in for a SQLAlchemy result object."""
+
+    __slots__ = ("_first", "_all", "_mappings_all")
+
+    def __init__(self, first=None, all_=None, mappings_all=None):
+        self._first = first
+        self._all = all_ if all_ is not None else []
+        self._mappings_all = mappings_all if mappings_all is not None else []
+
+    def first(self):
+        return self._first
+
+    def all(self):
+        return self._all
+
+    def mappings(self):
+        return FakeResult(all_=self._mappings_all)
+
+
+class FakeSession:
+    """Concrete async-session stub.
+
+    Much cheaper than an AsyncMock tree: no coroutine wrapping, call
+    recording, or __getattr__ dispatch per call. Tests queue results in
+    exec_results / execute_results (consumed in order, last one repeats)
+    and assert on the plain counters afterwards.
+    """
+
+    __slots__ = (
+        "added",
+        "commits",
+        "refreshes",
+        "exec_calls",
+        "execute_calls",
+        "exec_queries",
+        "execute_queries",
+        "exec_results",
+        "execute_results",
+    )
+
+    def __init__(self):
+        self.added = []
+        self.commits = 0
+        self.refreshes = 0
+        self.exec_calls = 0
+        self.execute_calls = 0
+        self.exec_queries = []
+        self.execute_queries = []
+        self.exec_results = []
+        self.execute_results = []
+
+    def _next(self, results):
+        if not results:
+            return FakeResult()
+        if len(results) > 1:
+            return results.pop(0)
+        return results[0]
+
+    async def exec(self, query):
+        self.exec_calls += 1
+        self.exec_queries.append(query)
+        return self._next(self.exec_results)
+
+    async def execute(self, query):
+        self.execute_calls += 1
+        self.execute_queries.append(query)
+        return self._next(self.execute_results)
+
+    def add(self, obj):
+        self.added.append(obj)
+
+    async def commit(self):
+        self.commits += 1
+
+    async def refresh(self, obj):
+        self.refreshes += 1
+
+
+@pytest.fixture(scope="session")
+def anyio_backend():
+    """Run every async test on asyncio; no trio backend matrix."""
+    return "asyncio"
+
+
+@pytest.fixture
+def mock_session():
+    """Create a fake session for testing."""
+    return FakeSession()
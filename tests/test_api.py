@@ -1,101 +1,123 @@
+import json
 import pytest
+from contextlib import contextmanager
+from datetime import timedelta
+from types import MappingProxyType
+from typing import Final
 from fastapi.testclient import TestClient
-from unittest.mock import patch, AsyncMock, MagicMock
+from unittest.mock import AsyncMock
 from fastapi import HTTPException, status
 
 from main import app
 from dacodes_test.auth.jwt import create_access_token
-from dacodes_test.models import get_session
 from dacodes_test.models.users import UserModel
 from dacodes_test.models.games import GameSessionModel, GameSessionStatus
+from dacodes_test.responses.leaderboards import LeaderboardUserStatsItem
 
 
-@pytest.fixture
+# One template built at import time and treated as immutable: tests that
+# need variations clone it with model_copy. The plain constructor skips
+# validation for table models and, unlike model_construct, leaves the
+# instance properly instrumented for attribute access.
+_USER_TEMPLATE: Final = UserModel(
+    id=1,
+    username="testuser",
+    email="test@example.com",
+    password_hash="hashed_password"
+)
+
+
+def _aret(value):
+    """Return an async callable that resolves to ``value``.
+
+    Cheaper stand-in than an AsyncMock when a test only needs a canned
+    awaitable result and never inspects call arguments.
+    """
+    async def _inner(*args, **kwargs):
+        return value
+    return _inner
+
+
+@pytest.fixture(scope="session")
 def client():
-    """Create a test client for the FastAPI app."""
-    with TestClient(app) as client:
+    """Create a test client for the FastAPI app, booted once per run."""
+    with TestClient(app, backend_options={"use_uvloop": False}) as client:
+        # Pre-warm the ASGI transport so the first real test does not pay
+        # for lifespan startup and route-table compilation.
+        client.get("/health-check")
         yield client
 
 
 @pytest.fixture
 def test_user():
-    """Create a test user."""
-    return UserModel(
-        id=1,
-        username="testuser",
-        email="test@example.com",
-        password_hash="hashed_password"
-    )
+    """Return the shared test user; no test mutates it, so no copy."""
+    return _USER_TEMPLATE
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def auth_token(client):
-    """Get a real authentication token for testing."""
-    # Login with one of the test users
-    response = client.post(
-        "/auth/login",
-        data={
-            "username": "edygg_1",
-            "password": "password"
-        },
-        headers={"Content-Type": "application/x-www-form-urlencoded"}
-    )
-
-    # Check that the login was successful
-    assert response.status_code == 200
-    data = response.json()
-    assert "access_token" in data
+    """Mint a valid token for the test user without the bcrypt login path."""
+    # Make sure the test user exists; ignore the failure when a previous
+    # run already registered it.
+    try:
+        client.post(
+            "/auth/register",
+            json={
+                "username": "edygg_1",
+                "email": "efgm1024@gmail.com",
+                "password": "password"
+            }
+        )
+    except Exception:
+        pass
 
-    # Return the token
-    return data["access_token"]
+    return create_access_token(
+        data={"sub": "edygg_1"},
+        expires_delta=timedelta(hours=1),
+    )
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def auth_headers(auth_token):
-    """Create authorization headers with the auth token."""
-    return {"Authorization": f"Bearer {auth_token}"}
-
-
-@pytest.fixture
-def mock_get_session():
-    """Create a mock session for testing."""
-    # We'll use a simpler approach - just patch the specific functions that are called
-    # This fixture is kept for compatibility with existing tests
-    session = AsyncMock()
+    """Create authorization headers with the auth token.
 
-    # Setup the dependency override
-    app.dependency_overrides = {}  # Clear any existing overrides
+    The mapping is shared across every test in the session, so freeze it:
+    an accidental mutation in one test would silently leak into the rest.
+    """
+    return MappingProxyType({"Authorization": f"Bearer {auth_token}"})
 
-    async def override_get_session():
-        yield session
 
-    app.dependency_overrides[get_session] = override_get_session
+@contextmanager
+def _override(dependency, implementation):
+    """Swap one entry in app.dependency_overrides, restoring it on exit.
 
-    yield session
+    Mutating the single dict in place keeps FastAPI's cached reference to
+    it valid; reassigning a fresh dict per fixture would also clobber
+    overrides installed by other fixtures in the same test.
+    """
+    previous = app.dependency_overrides.get(dependency)
+    app.dependency_overrides[dependency] = implementation
+    try:
+        yield
+    finally:
+        if previous is None:
+            app.dependency_overrides.pop(dependency, None)
+        else:
+            app.dependency_overrides[dependency] = previous
 
-    # Clean up
-    app.dependency_overrides = {}
 
 @pytest.fixture
 def mock_auth_dependencies(test_user):
     """Override authentication dependencies for testing."""
-    # Setup the dependency override
-    app.dependency_overrides = {}  # Clear any existing overrides
-
-    # Import the dependencies we need to override
     from dacodes_test.auth.jwt import CurrentUserDep
 
-    # Override the CurrentUserDep dependency directly
-    # This is the key change - we're bypassing the entire auth chain
-    app.dependency_overrides[CurrentUserDep] = lambda: test_user
-
-    yield
-
-    # Clean up
-    app.dependency_overrides = {}
+    # Bypass the entire auth chain by overriding CurrentUserDep directly
+    with _override(CurrentUserDep, lambda: test_user):
+        yield
 
 
 # Test health check endpoint
+@pytest.mark.smoke
 def test_health_check(client):
     """Test the health check endpoint."""
     response = client.get("/health-check")
@@ -104,90 +126,82 @@ def test_health_check(client):
 
 
 # Test register endpoint
-def test_register_user(client, mock_get_session):
+def test_register_user(client, monkeypatch):
     """Test user registration endpoint."""
-    with patch("dacodes_test.models.users.create_user") as mock_create_user:
-        # Configure the mock to return a user
-        user_model = UserModel(
-            id=1,
-            username="newuser",
-            email="new@example.com",
-            password_hash="hashed_password"
-        )
-
-        # For async functions, we need to use side_effect with an async function
-        async def mock_create_user_side_effect(*args, **kwargs):
-            return user_model
+    # Configure the mock to return a user
+    user_model = _USER_TEMPLATE.model_copy(
+        update={"username": "newuser", "email": "new@example.com"}
+    )
 
-        mock_create_user.side_effect = mock_create_user_side_effect
+    # Patch the name the route actually calls so no session work happens
+    monkeypatch.setattr("main.create_user", _aret(user_model))
 
-        # Test successful registration
-        response = client.post(
-            "/auth/register",
-            json={
-                "username": "newuser",
-                "email": "new@example.com",
-                "password": "password123"
-            }
-        )
+    # Test successful registration
+    response = client.post(
+        "/auth/register",
+        json={
+            "username": "newuser",
+            "email": "new@example.com",
+            "password": "password123"
+        }
+    )
 
-        assert response.status_code == 200
-        data = response.json()
-        assert "username" in data
-        assert "email" in data
+    assert response.status_code == 200
+    data = response.json()
+    assert "username" in data
+    assert "email" in data
 
-        # Test invalid input
-        response = client.post(
-            "/auth/register",
-            json={
-                "username": "newuser",
-                # Missing email and password
-            }
-        )
+    # Test invalid input
+    response = client.post(
+        "/auth/register",
+        json={
+            "username": "newuser",
+            # Missing email and password
+        }
+    )
 
-        assert response.status_code == 422  # Validation error
+    assert response.status_code == 422  # Validation error
 
 
 # Test login endpoint
-def test_login_user(client, test_user):
+def test_login_user(client, test_user, monkeypatch):
     """Test user login endpoint."""
     # Patch the authenticate_user function directly
-    with patch("main.authenticate_user") as mock_authenticate:
-        # Configure the mock for successful login
-        mock_authenticate.return_value = test_user
-
-        # Test successful login
-        response = client.post(
-            "/auth/login",
-            data={
-                "username": "testuser",
-                "password": "password123"
-            },
-            headers={"Content-Type": "application/x-www-form-urlencoded"}
-        )
+    mock_authenticate = AsyncMock(return_value=test_user)
+    monkeypatch.setattr("main.authenticate_user", mock_authenticate)
 
-        assert response.status_code == 200
-        data = response.json()
-        assert "access_token" in data
-        assert data["token_type"] == "bearer"
-
-        # Configure the mock for failed login
-        mock_authenticate.return_value = None
-
-        # Test invalid credentials
-        response = client.post(
-            "/auth/login",
-            data={
-                "username": "wronguser",
-                "password": "wrongpassword"
-            },
-            headers={"Content-Type": "application/x-www-form-urlencoded"}
-        )
+    # Test successful login
+    response = client.post(
+        "/auth/login",
+        data={
+            "username": "testuser",
+            "password": "password123"
+        },
+        headers={"Content-Type": "application/x-www-form-urlencoded"}
+    )
+
+    assert response.status_code == 200
+    data = response.json()
+    assert "access_token" in data
+    assert data["token_type"] == "bearer"
 
-        assert response.status_code == 401
-        data = response.json()
-        assert "detail" in data
-        assert data["detail"] == "Incorrect username or password"
+    # Configure the mock for failed login
+    mock_authenticate.return_value = None
+
+    # Test invalid credentials
+    response = client.post(
+        "/auth/login",
+        data={
+            "username": "wronguser",
+            "password": "wrongpassword"
+        },
+        headers={"Content-Type": "application/x-www-form-urlencoded"}
+    )
+
+    assert response.status_code == 401
+    data = response.json()
+    assert "detail" in data
+    assert data["detail"] == "Incorrect username or password"
 
 
 # Test start game endpoint
@@ -244,86 +258,78 @@ def test_stop_game(client, auth_headers):
 
 
 # Test leaderboard endpoint
-def test_get_leaderboard(client):
+def test_get_leaderboard(client, monkeypatch):
     """Test leaderboard endpoint."""
-    # Patch the function directly
-    with patch("dacodes_test.models.games.calc_leaderboard") as mock_calc_leaderboard:
-        # Configure the mock for default pagination
-        mock_calc_leaderboard.return_value = [
-            {
-                "username": "user1",
-                "total_games": 5,
-                "average_deviation": 100.5,
-                "best_deviation": 50.2
-            },
-            {
-                "username": "user2",
-                "total_games": 3,
-                "average_deviation": 150.7,
-                "best_deviation": 75.3
-            }
-        ]
+    # Patch the name the route actually calls; model_construct skips the
+    # re-validation of payloads that are already the response model.
+    mock_calc_leaderboard = AsyncMock(return_value=[
+        LeaderboardUserStatsItem.model_construct(
+            user_id=1,
+            username="user1",
+            total_games=5,
+            average_deviation=100.5,
+            best_deviation=50.2
+        ),
+        LeaderboardUserStatsItem.model_construct(
+            user_id=2,
+            username="user2",
+            total_games=3,
+            average_deviation=150.7,
+            best_deviation=75.3
+        )
+    ])
+    monkeypatch.setattr("main.calc_leaderboard", mock_calc_leaderboard)
 
-        # Test default pagination
-        response = client.get("/leaderboard")
-
-        assert response.status_code == 200
-        data = response.json()
-        assert len(data) == 2
-        assert "username" in data[0]
-        assert "total_games" in data[0]
-        assert "average_deviation" in data[0]
-        assert "best_deviation" in data[0]
-
-        # Configure the mock for custom pagination
-        mock_calc_leaderboard.return_value = [
-            {
-                "username": "user3",
-                "total_games": 2,
-                "average_deviation": 200.1,
-                "best_deviation": 100.0
-            }
-        ]
+    # Test default pagination
+    response = client.get("/leaderboard")
+
+    assert response.status_code == 200
+    data = response.json()
+    assert len(data) == 2
+    assert "username" in data[0]
+    assert "total_games" in data[0]
+    assert "average_deviation" in data[0]
+    assert "best_deviation" in data[0]
+
+    # Configure the mock for custom pagination
+    mock_calc_leaderboard.return_value = [
+        LeaderboardUserStatsItem.model_construct(
+            user_id=3,
+            username="user3",
+            total_games=2,
+            average_deviation=200.1,
+            best_deviation=100.0
+        )
+    ]
 
-        # Test custom pagination
-        response = client.get("/leaderboard?page=2&per_page=5")
+    # Test custom pagination
+    response = client.get("/leaderboard?page=2&per_page=5")
 
-        assert response.status_code == 200
-        data = response.json()
-        assert len(data) == 1
+    assert response.status_code == 200
+    data = response.json()
+    assert len(data) == 1
 
 
 # Test user game history endpoint
-def test_get_user_game_history_success(client):
+def test_get_user_game_history_success(client, monkeypatch):
     """Test getting user game history successfully."""
     user_id = 1
 
-    # Patch the functions directly
-    with patch("dacodes_test.models.users.get_user_by_id") as mock_get_user_by_id, \
-         patch("dacodes_test.models.games.has_game_history") as mock_has_game_history, \
-         patch("dacodes_test.models.games.user_game_history") as mock_user_game_history:
-
-        # Configure the mocks
-        mock_get_user_by_id.return_value = UserModel(
-            id=user_id,
-            username="testuser",
-            email="test@example.com",
-            password_hash="hashed_password"
-        )
-        mock_has_game_history.return_value = True
-        mock_user_game_history.return_value = {
-            "username": "testuser",
-            "total_games": 3,
-            "average_deviation": 120.5,
-            "best_deviation": 60.2,
-            "history": [
-                {"id": 1, "user_id": user_id, "status": "stopped"},
-                {"id": 2, "user_id": user_id, "status": "stopped"},
-                {"id": 3, "user_id": user_id, "status": "active"}
-            ]
-        }
+    # Patch the name the route actually calls
+    monkeypatch.setattr("main.user_game_history", _aret({
+        "user_id": user_id,
+        "username": "testuser",
+        "total_games": 3,
+        "average_deviation": 120.5,
+        "best_deviation": 60.2,
+        "history": [
+            {"id": 1, "status": GameSessionStatus.STOPPED},
+            {"id": 2, "status": GameSessionStatus.STOPPED},
+            {"id": 3, "status": GameSessionStatus.ACTIVE}
+        ]
+    }))
 
-        response = client.get(f"/analytics/user/{user_id}")
+    response = client.get(f"/analytics/user/{user_id}")
 
     assert response.status_code == 200
     data = response.json()
@@ -334,16 +340,14 @@ def test_get_user_game_history_success(client):
     assert len(data["history"]) == 3
 
 
-def test_get_user_game_history_user_not_found(client):
+def test_get_user_game_history_user_not_found(client, monkeypatch):
     """Test getting game history for non-existent user."""
     user_id = 999
 
-    # Patch the function directly
-    with patch("dacodes_test.models.users.get_user_by_id") as mock_get_user_by_id:
-        # Configure the mock
-        mock_get_user_by_id.return_value = None
+    # The fused stats query returns no row for an unknown user
+    monkeypatch.setattr("main.user_game_history", _aret(None))
 
-        response = client.get(f"/analytics/user/{user_id}")
+    response = client.get(f"/analytics/user/{user_id}")
 
     assert response.status_code == 404
     data = response.json()
@@ -351,26 +355,69 @@ def test_get_user_game_history_user_not_found(client):
     assert data["detail"] == "No user found."
 
 
-def test_get_user_game_history_no_games(client):
+def test_get_user_game_history_no_games(client, monkeypatch):
     """Test getting game history for user with no games."""
     user_id = 1
 
-    # Patch the functions directly
-    with patch("dacodes_test.models.users.get_user_by_id") as mock_get_user_by_id, \
-         patch("dacodes_test.models.games.has_game_history") as mock_has_game_history:
+    # A known user with zero stopped games yields an empty stats row
+    monkeypatch.setattr("main.user_game_history", _aret({
+        "user_id": user_id,
+        "username": "testuser",
+        "total_games": 0,
+        "average_deviation": 0.0,
+        "best_deviation": 0.0,
+        "history": []
+    }))
 
-        # Configure the mocks
-        mock_get_user_by_id.return_value = UserModel(
-            id=user_id,
-            username="testuser",
-            email="test@example.com",
-            password_hash="hashed_password"
-        )
-        mock_has_game_history.return_value = False
-
-        response = client.get(f"/analytics/user/{user_id}")
+    response = client.get(f"/analytics/user/{user_id}")
 
     assert response.status_code == 404
     data = response.json()
     assert "detail" in data
     assert data["detail"] == "No games found."
+
+
+# Test user game history export endpoint
+def test_export_user_game_history(client, auth_headers):
+    """Test streaming a user's game history as NDJSON."""
+    # Play one full game so the exported user has at least one history row
+    start_response = client.post("/games/start", headers=auth_headers)
+    assert start_response.status_code == 200
+    game_session_id = start_response.json()["id"]
+
+    stop_response = client.post(f"/games/{game_session_id}/stop", headers=auth_headers)
+    assert stop_response.status_code == 200
+    user_id = stop_response.json()["user_id"]
+
+    response = client.get(f"/analytics/user/{user_id}/export")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+
+    lines = [json.loads(line) for line in response.content.splitlines()]
+
+    # First frame carries the aggregated stats
+    stats = lines[0]
+    assert stats["user_id"] == user_id
+    assert stats["total_games"] >= 1
+    assert "average_deviation" in stats
+    assert "best_deviation" in stats
+
+    # Remaining frames are one game session row each
+    rows = lines[1:]
+    assert len(rows) >= stats["total_games"]
+    for row in rows:
+        assert row["id"] is not None
+        assert "start_time" in row
+        assert "deviation" in row
+        assert "status" in row
+
+
+def test_export_user_game_history_user_not_found(client):
+    """Test exporting game history for non-existent user."""
+    response = client.get("/analytics/user/999999/export")
+
+    assert response.status_code == 404
+    data = response.json()
+    assert "detail" in data
+    assert data["detail"] == "No user found."
@@ -1,5 +1,5 @@
 import pytest
-from unittest.mock import AsyncMock, MagicMock, patch
+from collections import namedtuple
 from sqlmodel import select
 
 from dacodes_test.models.games import (
@@ -8,58 +8,50 @@ from dacodes_test.models.games import (
     start_game_session,
     stop_game_session,
     calc_leaderboard,
+    leaderboard_cache,
     user_game_history,
     has_game_history,
 )
 from dacodes_test.models.users import UserModel
-from dacodes_test.models.utils import get_utc_timestamp
+from tests.conftest import FakeResult
 
 
-@pytest.fixture
-def mock_session():
-    """Create a mock session for testing."""
-    session = AsyncMock()
-    session.exec = AsyncMock()
-    session.execute = AsyncMock()
-    session.add = MagicMock()
-    session.commit = AsyncMock()
-    session.refresh = AsyncMock()
-    return session
+# Frozen timestamps (2024-01-01T00:00:00Z and 15s later, in unix ms); the
+# arithmetic in stop_game_session only cares about the delta, so there is
+# no reason to read the clock per test run.
+_START_MS = 1704067200000
+_STOP_MS = _START_MS + 15000
+
+# Attribute-access row stub for the fused stats query; a namedtuple is far
+# lighter than a MagicMock and fails loudly on unknown attributes.
+_StatsRow = namedtuple(
+    "_StatsRow", ["username", "total_games", "avg_deviation", "best_deviation"]
+)
 
 
-@pytest.mark.asyncio
+@pytest.mark.anyio
 async def test_start_game_session_new(mock_session):
     """Test start_game_session when user has no active game session."""
     # Arrange
     user_id = 1
 
-    # Mock the query execution for checking active sessions
-    mock_results = MagicMock()
-    mock_results.first.return_value = None
-    mock_session.exec.return_value = mock_results
-
-    # Set up the mock to return the expected game session after refresh
-    async def mock_refresh(game_session):
-        game_session.id = 1
-        return None
-
-    mock_session.refresh.side_effect = mock_refresh
+    # No active session found
+    mock_session.exec_results = [FakeResult(first=None)]
 
     # Act
     result = await start_game_session(mock_session, user_id)
 
     # Assert
-    mock_session.exec.assert_called_once()
-    mock_session.add.assert_called_once()
-    mock_session.commit.assert_called_once()
-    mock_session.refresh.assert_called_once()
+    assert mock_session.exec_calls == 1
+    assert len(mock_session.added) == 1
+    assert mock_session.commits == 1
+    assert mock_session.refreshes == 0
 
     assert result.user_id == user_id
-    assert result.id == 1
     assert result.status == GameSessionStatus.ACTIVE
 
 
-@pytest.mark.asyncio
+@pytest.mark.anyio
 async def test_start_game_session_existing(mock_session):
     """Test start_game_session when user already has an active game session."""
     # Arrange
@@ -70,25 +62,21 @@ async def test_start_game_session_existing(mock_session):
         status=GameSessionStatus.ACTIVE,
     )
 
-    # Mock the query execution
-    mock_results = MagicMock()
-    mock_results.first.return_value = existing_game_session
-    mock_session.exec.return_value = mock_results
+    mock_session.exec_results = [FakeResult(first=existing_game_session)]
 
     # Act
     result = await start_game_session(mock_session, user_id)
 
     # Assert
-    mock_session.exec.assert_called_once()
-    mock_session.add.assert_not_called()
-    mock_session.commit.assert_not_called()
-    mock_session.refresh.assert_not_called()
+    assert mock_session.exec_calls == 1
+    assert mock_session.added == []
+    assert mock_session.commits == 0
 
     assert result == existing_game_session
 
 
-@pytest.mark.asyncio
-async def test_stop_game_session_success(mock_session):
+@pytest.mark.anyio
+async def test_stop_game_session_success(mock_session, monkeypatch):
     """Test stop_game_session when game session exists and is active."""
     # Arrange
     user_id = 1
@@ -99,79 +87,70 @@ async def test_stop_game_session_success(mock_session):
         id=game_session_id,
         user_id=user_id,
         status=GameSessionStatus.ACTIVE,
-        start_time=get_utc_timestamp(),
+        start_time=_START_MS,
     )
 
-    # Mock the query execution
-    mock_results = MagicMock()
-    mock_results.first.return_value = game_session
-    mock_session.exec.return_value = mock_results
+    mock_session.exec_results = [FakeResult(first=game_session)]
 
-    # Act
-    with patch('dacodes_test.models.games.get_utc_timestamp') as mock_timestamp:
-        # Mock the timestamp to be 15 seconds after start_time
-        stop_time = get_utc_timestamp()
-        mock_timestamp.return_value = stop_time
+    # Freeze the clock 15 seconds after start_time
+    monkeypatch.setattr(
+        "dacodes_test.models.games.get_utc_timestamp_ms", lambda: _STOP_MS
+    )
 
-        result = await stop_game_session(mock_session, game_session_id, user_id)
+    # Act
+    result = await stop_game_session(mock_session, game_session_id, user_id)
 
     # Assert
-    assert mock_session.exec.call_count == 1
-    assert mock_session.add.call_count == 2  # Called twice in the function
-    assert mock_session.commit.call_count == 2  # Called twice in the function
-    assert mock_session.refresh.call_count == 2  # Called twice in the function
+    assert mock_session.exec_calls == 1
+    assert len(mock_session.added) == 1  # Single transaction for all mutations
+    assert mock_session.commits == 1
+    assert mock_session.refreshes == 0
 
     assert result.id == game_session_id
     assert result.user_id == user_id
     assert result.status == GameSessionStatus.STOPPED
-    assert result.stop_time == stop_time
+    assert result.stop_time == _STOP_MS
     assert result.duration is not None
     assert result.deviation is not None
 
 
-@pytest.mark.asyncio
+@pytest.mark.anyio
 async def test_stop_game_session_not_found(mock_session):
     """Test stop_game_session when game session does not exist."""
     # Arrange
     user_id = 1
     game_session_id = 999  # Non-existent ID
 
-    # Mock the query execution
-    mock_results = MagicMock()
-    mock_results.first.return_value = None
-    mock_session.exec.return_value = mock_results
+    mock_session.exec_results = [FakeResult(first=None)]
 
     # Act
     result = await stop_game_session(mock_session, game_session_id, user_id)
 
     # Assert
-    mock_session.exec.assert_called_once()
-    mock_session.add.assert_not_called()
-    mock_session.commit.assert_not_called()
-    mock_session.refresh.assert_not_called()
+    assert mock_session.exec_calls == 1
+    assert mock_session.added == []
+    assert mock_session.commits == 0
 
     assert result is None
 
 
-@pytest.mark.asyncio
+@pytest.mark.anyio
 async def test_calc_leaderboard(mock_session):
     """Test calc_leaderboard function."""
     # Arrange
+    leaderboard_cache.clear()  # Make sure the query actually runs
     mock_results = [
-        MagicMock(username="user1", total_games=5, avg_deviation=100.5, best_deviation=50.2),
-        MagicMock(username="user2", total_games=3, avg_deviation=150.7, best_deviation=75.3),
+        {"user_id": 1, "username": "user1", "total_games": 5, "average_deviation": 100.5, "best_deviation": 50.2},
+        {"user_id": 2, "username": "user2", "total_games": 3, "average_deviation": 150.7, "best_deviation": 75.3},
     ]
 
-    # Mock the session.execute().all() call
-    mock_execute_result = MagicMock()
-    mock_execute_result.all.return_value = mock_results
-    mock_session.execute.return_value = mock_execute_result
+    mock_session.execute_results = [FakeResult(mappings_all=mock_results)]
 
     # Act
     result = await calc_leaderboard(mock_session)
 
     # Assert
-    mock_session.execute.assert_called_once()
+    assert mock_session.execute_calls == 1
 
     assert len(result) == 2
     assert result[0]["username"] == "user1"
@@ -185,25 +164,51 @@ async def test_calc_leaderboard(mock_session):
     assert result[1]["best_deviation"] == 75.3
 
 
-@pytest.mark.asyncio
+@pytest.mark.anyio
+async def test_calc_leaderboard_keyset_pagination(mock_session):
+    """Test that a cursor makes calc_leaderboard seek instead of using OFFSET."""
+    # Arrange
+    leaderboard_cache.clear()  # Make sure the query actually runs
+    mock_results = [
+        {"user_id": 3, "username": "user3", "total_games": 2, "average_deviation": 200.1, "best_deviation": 100.0},
+    ]
+
+    mock_session.execute_results = [FakeResult(mappings_all=mock_results)]
+
+    # Act
+    result = await calc_leaderboard(
+        mock_session,
+        page=5,
+        per_page=10,
+        after_avg_deviation=150.7,
+        after_user_id=2,
+    )
+
+    # Assert
+    assert mock_session.execute_calls == 1
+    assert result == mock_results
+
+    # The cursor becomes a row-value HAVING seek and replaces the page scan
+    sql = str(mock_session.execute_queries[0])
+    assert "HAVING" in sql
+    assert "OFFSET" not in sql
+    assert "LIMIT" in sql
+
+
+@pytest.mark.anyio
 async def test_user_game_history_with_history(mock_session):
     """Test user_game_history when user has game history."""
     # Arrange
     user_id = 1
 
     # Mock the stats query result
-    mock_stats = MagicMock(
+    mock_stats = _StatsRow(
         username="testuser",
         total_games=3,
         avg_deviation=120.5,
         best_deviation=60.2
     )
 
-    # Mock the session.execute().first() call for stats
-    mock_execute_result = MagicMock()
-    mock_execute_result.first.return_value = mock_stats
-    mock_session.execute.return_value = mock_execute_result
-
     # Mock the game history
     game_history = [
         GameSessionModel(id=1, user_id=user_id, status=GameSessionStatus.STOPPED),
@@ -211,21 +216,17 @@ async def test_user_game_history_with_history(mock_session):
         GameSessionModel(id=3, user_id=user_id, status=GameSessionStatus.ACTIVE),
     ]
 
-    # Mock the session.exec().all() call for game history
-    mock_exec_result = MagicMock()
-    mock_exec_result.all.return_value = game_history
-    mock_session.exec.return_value = mock_exec_result
-
-    # Mock the dict method for GameSessionModel
-    with patch('dacodes_test.models.games.GameSessionModel.dict', 
-               side_effect=lambda: {"id": 1, "user_id": user_id, "status": "stopped"}):
+    # Stats query first, then the history query
+    mock_session.exec_results = [
+        FakeResult(first=mock_stats),
+        FakeResult(all_=game_history),
+    ]
 
-        # Act
-        result = await user_game_history(mock_session, user_id)
+    # Act
+    result = await user_game_history(mock_session, user_id)
 
     # Assert
-    mock_session.execute.assert_called_once()
-    mock_session.exec.assert_called_once()
+    assert mock_session.exec_calls == 2
 
     assert result["username"] == "testuser"
     assert result["total_games"] == 3
@@ -234,43 +235,18 @@ async def test_user_game_history_with_history(mock_session):
     assert len(result["history"]) == 3
 
 
-@pytest.mark.asyncio
-async def test_has_game_history_true(mock_session):
-    """Test has_game_history when user has game history."""
-    # Arrange
-    user_id = 1
-    game_history = [
-        GameSessionModel(id=1, user_id=user_id),
-        GameSessionModel(id=2, user_id=user_id),
-    ]
-
-    # Mock the query execution
-    mock_results = MagicMock()
-    mock_results.all.return_value = game_history
-    mock_session.exec.return_value = mock_results
-
-    # Act
-    result = await has_game_history(mock_session, user_id)
-
-    # Assert
-    mock_session.exec.assert_called_once()
-    assert result is True
-
-
-@pytest.mark.asyncio
-async def test_has_game_history_false(mock_session):
-    """Test has_game_history when user has no game history."""
+@pytest.mark.anyio
+@pytest.mark.parametrize("expected", [True, False], ids=["has_history", "no_history"])
+async def test_has_game_history(mock_session, expected):
+    """Test has_game_history for users with and without game history."""
     # Arrange
     user_id = 1
 
-    # Mock the query execution
-    mock_results = MagicMock()
-    mock_results.all.return_value = []
-    mock_session.exec.return_value = mock_results
+    mock_session.exec_results = [FakeResult(first=expected)]
 
     # Act
     result = await has_game_history(mock_session, user_id)
 
     # Assert
-    mock_session.exec.assert_called_once()
-    assert result is False
+    assert mock_session.exec_calls == 1
+    assert result is expected